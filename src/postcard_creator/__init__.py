@@ -1,10 +1,11 @@
 from ._auth import Token
-from ._creator import PostcardCreator
+from ._creator import AsyncPostcardCreator, PostcardCreator
 from ._error import FreeQuotaExceededException, PostcardCreatorException
 from ._types import Address, Quota
 
 __all__ = [
     "Address",
+    "AsyncPostcardCreator",
     "Quota",
     "FreeQuotaExceededException",
     "PostcardCreator",
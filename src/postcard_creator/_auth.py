@@ -2,14 +2,13 @@ import base64
 import datetime
 import hashlib
 import logging
-import re
 import secrets
 from collections.abc import Sequence
 from typing import Any, Literal
 from urllib.parse import parse_qs, urlencode, urlparse
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from requests.adapters import HTTPAdapter
 from urllib3 import Retry
 
@@ -17,6 +16,18 @@ from ._error import PostcardCreatorException
 
 _LOGGER = logging.getLogger(__package__)
 
+# only these few tags are looked up in the login pages, building a tree for the
+# rest of the (large) SAML documents is wasted work
+_SAML_INPUTS = SoupStrainer("input", attrs={"name": ["SAMLResponse", "RelayState"]})
+_LOGIN_FORM = SoupStrainer("form", attrs={"name": "LoginForm"})
+
+# sent along with the SAML response, as the android app does
+_SAML_HEADERS = {
+    "Origin": "https://account.post.ch",
+    "X-Requested-With": "ch.post.it.pcc",
+    "Upgrade-Insecure-Requests": "1",
+}
+
 
 def base64_encode(string: bytes) -> str:
     encoded = base64.urlsafe_b64encode(string).decode("ascii")
@@ -24,9 +35,9 @@ def base64_encode(string: bytes) -> str:
 
 
 def base64_decode(string: str) -> bytes:
-    padding = 4 - (len(string) % 4)
-    string = string + ("=" * padding)
-    return base64.urlsafe_b64decode(string)
+    # 0 to 3 characters of padding, none if the length is a multiple of 4
+    padding = -len(string) % 4
+    return base64.urlsafe_b64decode(string + "=" * padding)
 
 
 class Token(object):
@@ -44,6 +55,10 @@ class Token(object):
         )
         self.legacy_headers = {"User-Agent": self.user_agent}
         self.swissid_headers = {"User-Agent": self.user_agent}
+        # the device print only depends on the user agent. it is serialized
+        # with json=, so it stays a plain dict and must not be modified
+        self._device_print = self._formulate_anomaly_detection()
+        self._session: requests.Session | None = None
 
         self.token: str | None = None
         self.token_type: str | None = None
@@ -91,7 +106,7 @@ class Token(object):
         implementation_type = ""
         if method != "swissid":
             _LOGGER.info("using legacy username password authentication")
-            session = self._create_session()
+            session = self._get_session()
             try:
                 access_token = self._get_access_token_legacy(
                     session, username, password
@@ -111,7 +126,7 @@ class Token(object):
         if method != "legacy" and not success:
             _LOGGER.info("using swissid username password authentication")
             try:
-                session = self._create_session()
+                session = self._get_session()
                 access_token = self._get_access_token_swissid(
                     session, username, password
                 )
@@ -137,6 +152,15 @@ class Token(object):
             )
             raise e
 
+    def _get_session(self) -> requests.Session:
+        # the connections to the login hosts are kept alive between flows and
+        # fetches, but every flow starts without the cookies of the previous one
+        if self._session is None:
+            self._session = self._create_session()
+        else:
+            self._session.cookies.clear()
+        return self._session
+
     def _create_session(
         self,
         retries: int = 5,
@@ -152,7 +176,7 @@ class Token(object):
             backoff_factor=backoff_factor,
             status_forcelist=status_forcelist,
         )
-        adapter = HTTPAdapter(max_retries=retry)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
         session.mount("http://", adapter)
         session.mount("https://", adapter)
         return session
@@ -161,9 +185,7 @@ class Token(object):
         return base64_encode(secrets.token_bytes(64))
 
     def _get_code(self, code_verifier: str) -> str:
-        m = hashlib.sha256()
-        m.update(code_verifier.encode("utf-8"))
-        return base64_encode(m.digest())
+        return base64_encode(hashlib.sha256(code_verifier.encode("ascii")).digest())
 
     def _get_access_token_legacy(
         self, session: requests.Session, username: str, password: str
@@ -211,16 +233,20 @@ class Token(object):
             headers=self.legacy_headers,
             data=data_payload,
         )
-
-        resp = session.post(
-            url + urlencode(url_payload),
-            allow_redirects=True,
-            headers=self.legacy_headers,
-        )
-
-        saml_soup = BeautifulSoup(resp.text, "html.parser")
+        saml_soup = BeautifulSoup(resp.text, "html.parser", parse_only=_SAML_INPUTS)
         saml_response = saml_soup.find("input", {"name": "SAMLResponse"})
 
+        # the login usually answers with the SAML response right away. otherwise
+        # it is handed out to the now logged in session on a second request
+        if saml_response is None:
+            resp = session.post(
+                url + urlencode(url_payload),
+                allow_redirects=True,
+                headers=self.legacy_headers,
+            )
+            saml_soup = BeautifulSoup(resp.text, "html.parser", parse_only=_SAML_INPUTS)
+            saml_response = saml_soup.find("input", {"name": "SAMLResponse"})
+
         if saml_response is None or saml_response.get("value") is None:  # type: ignore
             raise PostcardCreatorException(
                 "Username/password authentication failed. Are your credentials valid?."
@@ -230,10 +256,7 @@ class Token(object):
         relay_state = (saml_soup.find("input", {"name": "RelayState"})["value"],)  # type: ignore
 
         url = "https://pccweb.api.post.ch/OAuth/"  # important: '/' at the end
-        customer_headers = self.legacy_headers
-        customer_headers["Origin"] = "https://account.post.ch"
-        customer_headers["X-Requested-With"] = "ch.post.it.pcc"
-        customer_headers["Upgrade-Insecure-Requests"] = str(1)
+        customer_headers = {**self.legacy_headers, **_SAML_HEADERS}
         saml_payload: dict[str, Any] = {
             "RelayState": relay_state,
             "SAMLResponse": saml_response,
@@ -263,7 +286,8 @@ class Token(object):
             "redirect_uri": redirect_uri,
         }
         url = "https://pccweb.api.post.ch/OAuth/token"
-        resp = requests.post(
+        session.cookies.clear()  # the token request is sent without the login cookies
+        resp = session.post(
             url, data=data, headers=self.legacy_headers, allow_redirects=False
         )
 
@@ -315,16 +339,10 @@ class Token(object):
             raise PostcardCreatorException("fail to fetch " + url)
 
         step1_goto_url = resp.history[len(resp.history) - 1].headers["Location"]
-        goto_match = re.search(r"goto=(.*?)$", step1_goto_url)
-        assert goto_match is not None
-        goto_param = goto_match.group(1)
-        try:
-            goto_param = goto_param.split("&")[0]
-        except Exception:
-            # only use goto_param without further params
-            pass
+        # only use goto_param without further params
+        goto_param = step1_goto_url.partition("goto=")[2].split("&", 1)[0]
         _LOGGER.debug("goto parm=" + goto_param)
-        if goto_param is None or goto_param == "":
+        if goto_param == "":
             raise PostcardCreatorException("swissid: cannot fetch goto param")
 
         url = (
@@ -359,8 +377,7 @@ class Token(object):
         url = (
             "https://login.swissid.ch/api-login/authenticate/basic?" + url_query_string
         )
-        headers = self.swissid_headers
-        headers["authId"] = resp.json()["tokens"]["authId"]
+        headers = {**self.swissid_headers, "authId": resp.json()["tokens"]["authId"]}
         step_data = {"username": username, "password": password}
         resp = session.post(url, json=step_data, headers=headers, allow_redirects=True)
 
@@ -375,12 +392,12 @@ class Token(object):
 
         resp = session.get(url, headers=self.swissid_headers, allow_redirects=True)
 
-        step7_soup = BeautifulSoup(resp.text, "html.parser")
+        step7_soup = BeautifulSoup(resp.text, "html.parser", parse_only=_LOGIN_FORM)
         url: str = step7_soup.find("form", {"name": "LoginForm"})["action"]  # type: ignore
         resp = session.post(url, headers=self.swissid_headers)
 
         # find saml response
-        step7_soup = BeautifulSoup(resp.text, "html.parser")
+        step7_soup = BeautifulSoup(resp.text, "html.parser", parse_only=_SAML_INPUTS)
         saml_response = step7_soup.find("input", {"name": "SAMLResponse"})
 
         if saml_response is None or saml_response.get("value") is None:  # type: ignore
@@ -390,10 +407,7 @@ class Token(object):
 
         # prepare access token
         url = "https://pccweb.api.post.ch/OAuth/"  # important: '/' at the end
-        customer_headers = self.swissid_headers
-        customer_headers["Origin"] = "https://account.post.ch"
-        customer_headers["X-Requested-With"] = "ch.post.it.pcc"
-        customer_headers["Upgrade-Insecure-Requests"] = str(1)
+        customer_headers = {**self.swissid_headers, **_SAML_HEADERS}
         saml_payload: dict[str, Any] = {
             "RelayState": step7_soup.find("input", {"name": "RelayState"})["value"],  # type: ignore
             "SAMLResponse": saml_response.get("value"),  # type: ignore
@@ -423,8 +437,9 @@ class Token(object):
             "redirect_uri": redirect_uri,
         }
         url = "https://pccweb.api.post.ch/OAuth/token"
-        resp = requests.post(
-            url,  # we do not use session here!
+        session.cookies.clear()  # the token request is sent without the login cookies
+        resp = session.post(
+            url,
             data=data,
             headers=self.swissid_headers,
             allow_redirects=False,
@@ -458,10 +473,8 @@ class Token(object):
                     "next action must be SEND_DEVICE_PRINT but got " + next_action
                 )
             auth_id_device_print = device_print_ctx["tokens"]["authId"]
-            device_print = self._formulate_anomaly_detection()
-            headers = self.swissid_headers
-            headers["authId"] = auth_id_device_print
-            resp = session.post(url, json=device_print, headers=headers)
+            headers = {**self.swissid_headers, "authId": auth_id_device_print}
+            resp = session.post(url, json=self._device_print, headers=headers)
         except Exception as e:
             msg = (
                 "Anomaly detection step failed. \n"
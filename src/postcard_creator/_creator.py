@@ -1,8 +1,16 @@
-import base64
+import asyncio
+import io
+import json
 import logging
-from typing import IO, Any
+import threading
+import time
+from collections.abc import Buffer, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Self
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
 
 from ._auth import Token
 from ._error import FreeQuotaExceededException, PostcardCreatorException
@@ -12,8 +20,16 @@ from ._types import (
     Quota,
 )
 
+try:
+    from pybase64 import b64encode as _b64encode
+except ImportError:
+    from base64 import b64encode as _b64encode
+
+
 _LOGGER = logging.getLogger(__package__)
 
+_OK_STATUS = frozenset((200, 201, 204))
+
 
 def _format_sender(sender: Address) -> dict[str, Any]:
     return {
@@ -40,30 +56,108 @@ def _format_recipient(recipient: Address) -> dict[str, Any]:
     }
 
 
-class PostcardCreator:
+class _Base64Writer(io.RawIOBase):
+    """Write only file object which base64 encodes everything written to it."""
+
+    def __init__(self) -> None:
+        self._encoded = bytearray()
+        self._tail = b""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Buffer) -> int:  # type: ignore[override]
+        # encode complete 3 byte groups right away and carry the rest over,
+        # so the image is never held unencoded in memory as a whole
+        view = memoryview(data).cast("B")
+        size = len(view)
+        if self._tail:
+            missing = 3 - len(self._tail)
+            self._tail += view[:missing]
+            view = view[missing:]
+            if len(self._tail) < 3:
+                return size
+            self._encoded += _b64encode(self._tail)
+            self._tail = b""
+        end = len(view) - len(view) % 3
+        self._encoded += _b64encode(view[:end])
+        self._tail = bytes(view[end:])
+        return size
+
+    def getvalue(self) -> bytearray:
+        if self._tail:
+            self._encoded += _b64encode(self._tail)
+            self._tail = b""
+        return self._encoded
+
+
+def _encode_upload_body(payload: dict[str, Any], images: dict[str, Buffer]) -> bytes:
+    # base64 needs no escaping in JSON, so the (large) images are spliced into the
+    # serialized payload as bytes instead of going through json.dumps and str.encode
+    parts = [json.dumps(payload).encode("ascii")[:-1]]
+    for key, data in images.items():
+        parts += [b', "', key.encode("ascii"), b'": "', data, b'"']
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+class _BearerAuth(AuthBase):
+    # the token is read per request as it may be refreshed in place
     def __init__(self, token: Token) -> None:
         self.token = token
-        self._session = requests.Session()
+
+    def __call__(self, r: requests.PreparedRequest) -> requests.PreparedRequest:
+        r.headers["Authorization"] = f"Bearer {self.token.token}"
+        return r
+
+
+class PostcardCreator:
+    # repeated get_quota calls within this many seconds are answered from memory
+    quota_ttl: float = 5.0
+
+    def __init__(self, token: Token, *, pool_maxsize: int = 4) -> None:
+        self.token = token
+        self._quota: tuple[float, Quota] | None = None
+        # get_quota runs concurrently with send_card. a send bumps the
+        # generation, so a quota fetched before it is not stored afterwards
+        self._quota_lock = threading.Lock()
+        self._quota_generation = 0
+        self.pool_maxsize = pool_maxsize
+        self._session = self._create_session()
+        self._session.headers["User-Agent"] = (
+            "Mozilla/5.0 (Linux; Android 6.0.1; wv) AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Version/4.0 Chrome/52.0.2743.98 Mobile Safari/537.36"
+        )
+        self._session.auth = _BearerAuth(token)
         self.host = "https://pccweb.api.post.ch/secure/api/mobile/v1"
 
-    def _get_headers(self):
-        return {
-            "User-Agent": "Mozilla/5.0 (Linux; Android 6.0.1; wv) AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Version/4.0 Chrome/52.0.2743.98 Mobile Safari/537.36",
-            "Authorization": "Bearer {}".format(self.token.token),
-        }
+    def _create_session(self) -> requests.Session:
+        # all requests go to the same host, keep the TLS connection alive between them
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_maxsize, pool_maxsize=self.pool_maxsize
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self) -> None:
+        self._session.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
 
     # XXX: we share some functionality with legacy wrapper here
     # however, it is little and not worth the lack of extensibility if generalized in super class
     def _do_op(self, method: str, endpoint: str, **kwargs: Any) -> requests.Response:
         url = self.host + endpoint
-        if "headers" not in kwargs or kwargs["headers"] is None:
-            kwargs["headers"] = self._get_headers()
-
-        _LOGGER.debug("{}: {}".format(method, url))
+        _LOGGER.debug("%s: %s", method, url)
         response = self._session.request(method, url, **kwargs)
 
-        if response.status_code not in [200, 201, 204]:
+        if response.status_code not in _OK_STATUS:
             e = PostcardCreatorException(
                 "error in request {} {}. status_code: {}, text: {}".format(
                     method, url, response.status_code, response.text or ""
@@ -80,12 +174,22 @@ class PostcardCreator:
             )
 
     def get_quota(self) -> Quota:
+        if self._quota is not None:
+            fetched_at, quota = self._quota
+            if time.monotonic() - fetched_at < self.quota_ttl:
+                return quota
+
         _LOGGER.debug("fetching quota")
         endpoint = "/user/quota"
 
+        generation = self._quota_generation
         payload = self._do_op("get", endpoint).json()
         self._validate_model_response(endpoint, payload)
-        return Quota.from_model(payload["model"])
+        quota = Quota.from_model(payload["model"])
+        with self._quota_lock:
+            if generation == self._quota_generation:
+                self._quota = (time.monotonic(), quota)
+        return quota
 
     def get_user_info(self):
         _LOGGER.debug("fetching user information")
@@ -115,9 +219,15 @@ class PostcardCreator:
         image_rotate: bool = True,
         paid: bool = False,
     ) -> Any:
-        img_base64 = base64.b64encode(
-            rotate_and_scale_image(
+        # the cover, the text image and the quota check are independent.
+        # PIL releases the GIL while resizing and encoding, so they overlap nicely
+        img_base64 = _Base64Writer()
+        img_text_base64 = _Base64Writer()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            cover_future = executor.submit(
+                rotate_and_scale_image,
                 picture,
+                img_base64,  # type: ignore[arg-type]
                 img_format="jpeg",
                 image_export=image_export,
                 image_rotate=image_rotate,
@@ -126,10 +236,19 @@ class PostcardCreator:
                 image_quality_factor=1,
                 image_target_height=1311,
             )
-        ).decode("ascii")
-        img_text_base64 = base64.b64encode(
-            create_text_image(message, image_export=image_export)
-        ).decode("ascii")
+            text_future = executor.submit(
+                create_text_image,
+                message,
+                img_text_base64,  # type: ignore[arg-type]
+                image_export=image_export,
+            )
+            quota_future = None
+            if not paid and not mock_send:
+                quota_future = executor.submit(self.get_quota)
+
+            cover_future.result()
+            text_future.result()
+
         endpoint = "/card/upload"
         payload: dict[str, Any] = {
             "lang": "en",
@@ -137,30 +256,100 @@ class PostcardCreator:
             "recipient": _format_recipient(recipient),
             "sender": _format_sender(sender),
             "text": "",
-            "textImage": img_text_base64,  # jpeg, JFIF standard 1.01, 720x744
-            "image": img_base64,  # jpeg, JFIF standard 1.01, 1819x1311
             "stamp": None,
         }
+        images = {
+            "textImage": img_text_base64.getvalue(),  # jpeg, JFIF 1.01, 720x744
+            "image": img_base64.getvalue(),  # jpeg, JFIF 1.01, 1819x1311
+        }
 
         if mock_send:
-            copy = dict(payload)
-            copy["textImage"] = "omitted"
-            copy["image"] = "omitted"
-            _LOGGER.info(f"mock_send=True, endpoint: {endpoint}, payload: {copy}")
+            copy = dict(payload, textImage="omitted", image="omitted")
+            _LOGGER.info("mock_send=True, endpoint: %s, payload: %s", endpoint, copy)
             return False
 
-        if not paid:
-            quota = self.get_quota()
+        if quota_future is not None:
+            quota = quota_future.result()
             if not quota.available:
                 msg = "Limit of free postcards exceeded."
                 if quota.next is not None:
                     msg += f"Try again at {quota.next.isoformat()}"
                 raise FreeQuotaExceededException(msg)
 
-        payload = self._do_op("post", endpoint, json=payload).json()
-        _LOGGER.debug(f"{endpoint} with response {payload}")
+        payload = self._do_op(
+            "post",
+            endpoint,
+            data=_encode_upload_body(payload, images),
+            headers={"Content-Type": "application/json"},
+        ).json()
+        _LOGGER.debug("%s with response %s", endpoint, payload)
 
         self._validate_model_response(endpoint, payload)
+        # a sent card uses up the quota
+        with self._quota_lock:
+            self._quota = None
+            self._quota_generation += 1
 
-        _LOGGER.info(f"postcard submitted, orderid {payload['model'].get('orderId')}")
+        _LOGGER.info("postcard submitted, orderid %s", payload["model"].get("orderId"))
         return payload["model"]
+
+
+class AsyncPostcardCreator:
+    """asyncio front end for PostcardCreator.
+
+    Every call runs the blocking client in a worker thread, so independent
+    cards can be sent concurrently with asyncio.gather. At most max_concurrent
+    calls run at once, which is also the size of the connection pool of the
+    underlying PostcardCreator. Further calls wait for a free connection
+    instead of opening (and discarding) extra ones.
+    """
+
+    def __init__(self, token: Token, *, max_concurrent: int = 4) -> None:
+        self.creator = PostcardCreator(token, pool_maxsize=max_concurrent)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def _run[T](self, func: Callable[..., T], /, **kwargs: Any) -> T:
+        async with self._semaphore:
+            return await asyncio.to_thread(func, **kwargs)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.creator.close)
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def get_quota(self) -> Quota:
+        return await self._run(self.creator.get_quota)
+
+    async def get_user_info(self):
+        return await self._run(self.creator.get_user_info)
+
+    async def get_billing_saldo(self):
+        return await self._run(self.creator.get_billing_saldo)
+
+    async def send_card(
+        self,
+        *,
+        message: str,
+        picture: IO[bytes],
+        recipient: Address,
+        sender: Address,
+        mock_send: bool = False,
+        image_export: bool = False,
+        image_rotate: bool = True,
+        paid: bool = False,
+    ) -> Any:
+        return await self._run(
+            self.creator.send_card,
+            message=message,
+            picture=picture,
+            recipient=recipient,
+            sender=sender,
+            mock_send=mock_send,
+            image_export=image_export,
+            image_rotate=image_rotate,
+            paid=paid,
+        )
@@ -1,19 +1,33 @@
+import atexit
+import contextlib
+import functools
 import importlib.resources
-import io
 import logging
 import os
 import textwrap
-from math import floor
+from math import ceil, sqrt
 from pathlib import Path
 from time import gmtime, strftime
 from typing import IO, Any, Literal
 
-from colorthief import ColorThief  # type: ignore
-from PIL import Image, ImageDraw, ImageFont
-from resizeimage import resizeimage  # type: ignore
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 
 _LOGGER = logging.getLogger(__package__)
 
+_TEXT_FONT_NAME = "open_sans_emoji.ttf"
+
+# baseline JFIF with 4:2:0 chroma subsampling as expected by the API
+_JPEG_SAVE_OPTIONS: dict[str, Any] = {
+    "quality": 85,
+    "subsampling": 2,
+    "progressive": False,
+    "optimize": False,
+}
+
+# zlib level 6 (the default) takes several times longer than level 1 while
+# hardly shrinking photos any further
+_PNG_SAVE_OPTIONS: dict[str, Any] = {"compress_level": 1}
+
 
 def _get_trace_postcard_sent_dir():
     path = os.path.join(os.getcwd(), ".postcard_creator_wrapper_sent")
@@ -23,6 +37,7 @@ def _get_trace_postcard_sent_dir():
 
 def rotate_and_scale_image(
     file: IO[bytes],
+    fp: IO[bytes],
     image_target_width: int = 154,
     image_target_height: int = 111,
     image_quality_factor: float = 20,
@@ -34,170 +49,255 @@ def rotate_and_scale_image(
     fallback_color_fill: bool = False,
     img_format: Literal["PNG", "jpeg"] = "PNG",
     **kwargs: Any,
-):
+) -> None:
     with Image.open(file) as image:
-        if image_rotate and image.width < image.height:
-            image = image.rotate(90, expand=True)
-            _LOGGER.debug("rotating image by 90 degrees")
+        # landscape images are used as they are. the target size is worked out
+        # on the (still undecoded) header, so that JPEGs can be drafted below
+        rotate = image_rotate and image.width < image.height
+        image_width, image_height = image.size
+        if rotate:
+            image_width, image_height = image_height, image_width
 
         if not enforce_size and (
-            image.width < image_quality_factor * image_target_width
-            or image.height < image_quality_factor * image_target_height
+            image_width < image_quality_factor * image_target_width
+            or image_height < image_quality_factor * image_target_height
         ):
-            factor_width = image.width / image_target_width
-            factor_height = image.height / image_target_height
+            factor_width = image_width / image_target_width
+            factor_height = image_height / image_target_height
             factor = min([factor_height, factor_width])
 
             _LOGGER.debug(
                 "image is smaller than default for resize/fill. "
-                "using scale factor {} instead of {}".format(
-                    factor, image_quality_factor
-                )
+                "using scale factor %s instead of %s",
+                factor,
+                image_quality_factor,
             )
             image_quality_factor = factor
 
-        width = image_target_width * image_quality_factor
-        height = image_target_height * image_quality_factor
+        width = int(image_target_width * image_quality_factor)
+        height = int(image_target_height * image_quality_factor)
+
+        # libjpeg can decode at 1/2, 1/4 or 1/8 scale straight from the DCT
+        # coefficients. keep twice the target size for the final resample, the
+        # same margin Image.thumbnail uses. this is a no-op for other formats,
+        # which are pre-shrunk by the reducing_gap in _resize_cover instead
+        draft_size = (height * 2, width * 2) if rotate else (width * 2, height * 2)
+        image.draft("RGB", draft_size)
+
+        # resize in the orientation of the source and rotate the much smaller
+        # result. a transpose only moves pixels and is cheaper than rotate(),
+        # which runs a general affine transform
+        size = (height, width) if rotate else (width, height)
         _LOGGER.debug(
-            "resizing image from {}x{} to {}x{}".format(
-                image.width, image.height, width, height
-            )
+            "resizing image from %sx%s to %sx%s",
+            image_width,
+            image_height,
+            width,
+            height,
         )
 
         # XXX: swissid endpoint expect specific size for postcard
         # if we have an image which is too small, do not upsample but rather center image and fill
         # with boundary color which is most dominant color in image
-        #
-        # validate=True will throw exception if image is too small
-        #
-        try:
-            cover = resizeimage.resize_cover(  # type: ignore
-                image,
-                [width, height],
-                validate=fallback_color_fill,  # type: ignore
-            )
-        except Exception as e:
-            _LOGGER.warning(e)
+        if fallback_color_fill and width > image_width and height > image_height:
             _LOGGER.warning(
-                f"resizing image from {image.width}x{image.height} to {width}x{height} failed."
+                f"image {image_width}x{image_height} is smaller than {width}x{height}."
                 f" using resize_contain mode as a fallback. Expect boundaries around img"
             )
 
-            color_thief = ColorThief(file)
-            (r, g, b) = color_thief.get_color(quality=1)  # type: ignore
-            color = (r, g, b, 0)  # type: ignore
-            cover = resizeimage.resize_contain(image, [width, height], bg_color=color)  # type: ignore
+            color = _get_dominant_color(image)
+            cover = _resize_contain(image, size, color)
             image_export = True
             _LOGGER.warning(
                 f"using image boundary color {color}, exporting image for visual inspection."
             )
+        else:
+            cover = _resize_cover(image, size)
 
         _LOGGER.debug("resizing done")
 
-        cover = cover.convert("RGB")  # type: ignore
-        with io.BytesIO() as f:
-            cover.save(f, img_format)  # type: ignore
-            scaled = f.getvalue()
+        if rotate:
+            cover = cover.transpose(Image.Transpose.ROTATE_90)
+            _LOGGER.debug("rotating image by 90 degrees")
+
+        # convert() always copies, even if there is nothing to convert
+        if cover.mode != "RGB":
+            cover = cover.convert("RGB")
+        save_options = _JPEG_SAVE_OPTIONS if img_format == "jpeg" else _PNG_SAVE_OPTIONS
+        cover.save(fp, img_format, **save_options)
 
         if image_export:
             name = strftime(
                 "postcard_creator_export_%Y-%m-%d_%H-%M-%S_cover.jpg", gmtime()
             )
             path = os.path.join(_get_trace_postcard_sent_dir(), name)
-            _LOGGER.info("exporting image to {} (image_export=True)".format(path))
-            cover.save(path)  # type: ignore
+            _LOGGER.info("exporting image to %s (image_export=True)", path)
+            cover.save(path)
+
+
+def _resize_cover(image: Image.Image, size: tuple[int, int]) -> Image.Image:
+    # only the centered region which ends up on the card is resampled, the
+    # crop is part of the resize so that no intermediate copy is made.
+    # LANCZOS matches the quality of the former resizeimage output, the
+    # reducing_gap lets PIL shrink large photos by an integer factor first
+    width, height = size
+    scale = max(width / image.width, height / image.height)
+    crop_width = width / scale
+    crop_height = height / scale
+    left = (image.width - crop_width) / 2
+    top = (image.height - crop_height) / 2
+    return image.resize(
+        size,
+        Image.Resampling.LANCZOS,
+        box=(left, top, left + crop_width, top + crop_height),
+        reducing_gap=3.0,
+    )
+
 
-    return scaled
+def _resize_contain(
+    image: Image.Image, size: tuple[int, int], color: tuple[int, int, int]
+) -> Image.Image:
+    # shrink (but never enlarge) into `size` and center on a `color` background
+    contained = image.copy()
+    contained.thumbnail(size, Image.Resampling.LANCZOS)
+    background = Image.new("RGB", size, color)
+    background.paste(
+        contained,
+        (
+            ceil((size[0] - contained.width) / 2),
+            ceil((size[1] - contained.height) / 2),
+        ),
+    )
+    return background
+
+
+def _get_dominant_color(image: Image.Image) -> tuple[int, int, int]:
+    # `file` has already been consumed, work on the decoded image instead.
+    # the most common color of a pixel sample, with 5 bits per channel so that
+    # slightly different shades count as the same color
+    sample = image.resize((64, 64), Image.Resampling.NEAREST).convert("RGB")
+    colors = ImageOps.posterize(sample, 5).getcolors(64 * 64)
+    _, color = max(colors)  # type: ignore
+    return color
 
 
 def create_text_image(
     text: str,
+    fp: IO[bytes],
     image_export: bool = False,
     line_height_mul: float = 1.15,
-) -> bytes:
+) -> None:
     """
-    Create a jpg with given text and return in bytes format
+    Create a jpg with given text and write it to fp
     """
     text_canvas_w = 720
     text_canvas_h = 744
     text_canvas_bg = "white"
     text_canvas_fg = "black"
-    text_canvas_font_name = "open_sans_emoji.ttf"
     text_margin = 10
 
-    def load_font(size: int):
-        with importlib.resources.as_file(
-            importlib.resources.files("postcard_creator").joinpath(
-                text_canvas_font_name
-            )
-        ) as font_path:
-            return ImageFont.truetype(str(font_path), size)
-
-    size_l = 10
-    size_r = 300
-    size = chars_per_line = line_h = text_y_start = 0
-    lines: list[str] = []
-    font: ImageFont.FreeTypeFont | None = None
-    while size_l < size_r:
-        size = floor((size_l + size_r) / 2.0)
-
-        font = load_font(size)
-        bbox = font.getbbox("1")
-        chars_per_line = int((text_canvas_w - 2 * text_margin) / (bbox[2] - bbox[0]))
-
-        lines = []
-        for line in text.splitlines():
-            lines.extend(textwrap.wrap(line, width=chars_per_line))
-
-        line_h = round(bbox[3] * line_height_mul)
-        total_h_with_margin = len(lines) * line_h + (2 * text_margin)
-
-        if total_h_with_margin < text_canvas_h:
-            # does fit
-            size_l = size + 1
-            text_y_start = (text_canvas_h - total_h_with_margin) // 2
-        else:
-            # does not fit
-            size_r = size - 1
-            text_y_start = 0
+    # the advance of "1" and the line height scale linearly with the font size,
+    # so they are measured once and the size is solved for instead of searched
+    bbox = _load_font(100).getbbox("1")
+    char_w_100 = bbox[2] - bbox[0]
+    char_h_100 = bbox[3]
 
-    assert font is not None
+    # neighbouring font sizes often end up with the same number of characters
+    # per line, wrap the text only once per width
+    paragraphs = text.splitlines()
+    wrapped: dict[int, list[str]] = {}
+
+    def layout(size: int) -> tuple[list[str], int]:
+        chars_per_line = int(
+            (text_canvas_w - 2 * text_margin) * 100 / (char_w_100 * size)
+        )
+
+        lines = wrapped.get(chars_per_line)
+        if lines is None:
+            lines = wrapped[chars_per_line] = [
+                line
+                for paragraph in paragraphs
+                for line in textwrap.wrap(paragraph, width=chars_per_line)
+            ]
+        return lines, round(char_h_100 * size / 100 * line_height_mul)
+
+    def fits(size: int) -> bool:
+        lines, line_h = layout(size)
+        return len(lines) * line_h + (2 * text_margin) < text_canvas_h
+
+    # if the text filled the canvas evenly, its area would grow with size**2.
+    # every paragraph takes at least one line, which bounds the size for many
+    # short paragraphs. wrapping only loses space at line ends, so the estimate
+    # is close and a few steps to the largest fitting size remain
+    size_min = 10
+    size_max = 300
+    text_w = text_canvas_w - 2 * text_margin
+    text_h = text_canvas_h - 2 * text_margin
+    line_h_100 = char_h_100 * line_height_mul
+    glyph_area_100 = max(1, len(text)) * char_w_100 * line_h_100
+    size = min(
+        int(100 * sqrt(text_w * text_h / glyph_area_100)),
+        int(100 * text_h / (max(1, len(paragraphs)) * line_h_100)),
+    )
+    size = min(max(size, size_min), size_max)
+    if fits(size):
+        while size < size_max and fits(size + 1):
+            size += 1
+    else:
+        while size > size_min and not fits(size):
+            size -= 1
+
+    lines, line_h = layout(size)
+    font = _load_font(size)
+    text_y_start = max(0, (text_canvas_h - len(lines) * line_h - 2 * text_margin) // 2)
     _LOGGER.debug(
-        f"using font with size: {size}px, chars per line: {chars_per_line} line-height: {line_h}px"
+        "using font with size: %spx, lines: %s line-height: %spx",
+        size,
+        len(lines),
+        line_h,
     )
 
     canvas = Image.new("RGB", (text_canvas_w, text_canvas_h), text_canvas_bg)
     draw = ImageDraw.Draw(canvas)
 
-    for line in lines:
-        line_w, actual_line_h = _get_font_bbox_dim(font, line)
-        if actual_line_h > line_h:
-            _LOGGER.warning(
-                "Line is higher than expected line height. %s > %s",
-                actual_line_h,
-                line_h,
-            )
-
-        draw.text(
-            ((text_canvas_w - line_w) // 2, text_y_start),
-            line,
-            font=font,
-            fill=text_canvas_fg,
-            embedded_color=True,
-        )
-        text_y_start += line_h
+    # multiline_text advances by the height of "A" plus `spacing` per line
+    draw.multiline_text(
+        (text_canvas_w // 2, text_y_start),
+        "\n".join(lines),
+        font=font,
+        fill=text_canvas_fg,
+        anchor="ma",
+        spacing=line_h - font.getbbox("A")[3],
+        align="center",
+        embedded_color=True,
+    )
 
     if image_export:
         name = strftime("postcard_creator_export_%Y-%m-%d_%H-%M-%S_text.jpg", gmtime())
         path = os.path.join(_get_trace_postcard_sent_dir(), name)
-        _LOGGER.info("exporting image to {} (image_export=True)".format(path))
+        _LOGGER.info("exporting image to %s (image_export=True)", path)
         canvas.save(path)
 
-    img_byte_arr = io.BytesIO()
-    canvas.save(img_byte_arr, format="jpeg")
-    return img_byte_arr.getvalue()
+    canvas.save(fp, format="jpeg", **_JPEG_SAVE_OPTIONS)
+
+
+# as_file may extract the font into a temporary file (e.g. for zipped installs),
+# which has to outlive every font loaded from it
+_RESOURCES = contextlib.ExitStack()
+atexit.register(_RESOURCES.close)
+
+
+@functools.cache
+def _get_font_path() -> str:
+    return str(
+        _RESOURCES.enter_context(
+            importlib.resources.as_file(
+                importlib.resources.files("postcard_creator").joinpath(_TEXT_FONT_NAME)
+            )
+        )
+    )
 
 
-def _get_font_bbox_dim(font: ImageFont.FreeTypeFont, text: str) -> tuple[int, int]:
-    left, top, right, bottom = font.getbbox(text)
-    return (int(right - left), int(bottom - top))
+@functools.lru_cache(maxsize=64)
+def _load_font(size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(_get_font_path(), size)
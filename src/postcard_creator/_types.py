@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import Any, Self
 
 
-@dataclasses.dataclass(frozen=True, kw_only=True)
+@dataclasses.dataclass(frozen=True, kw_only=True, slots=True)
 class Address:
     first_name: str
     last_name: str
@@ -16,7 +16,7 @@ class Address:
     salutation: str = ""
 
 
-@dataclasses.dataclass(frozen=True, kw_only=True)
+@dataclasses.dataclass(frozen=True, kw_only=True, slots=True)
 class Quota:
     quota: int
     end: datetime
@@ -39,7 +39,7 @@ class Quota:
         )
 
 
-@dataclasses.dataclass(frozen=True, kw_only=True)
+@dataclasses.dataclass(frozen=True, kw_only=True, slots=True)
 class OrderConfirmation:
     order_id: int
 
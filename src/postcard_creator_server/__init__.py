@@ -1,12 +1,30 @@
+import asyncio
+import binascii
 import importlib.metadata
 import io
+import json
 import logging
-from collections.abc import Iterator
+from collections.abc import Callable, Coroutine, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import IO, Annotated
+from http.cookiejar import DefaultCookiePolicy
+from typing import IO, Annotated, Any
 
-from fastapi import Depends, FastAPI, HTTPException
-from pydantic import BaseModel, Field
+import requests
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from pydantic import (
+    BaseModel,
+    Discriminator,
+    EncodedBytes,
+    EncoderProtocol,
+    Field,
+    Tag,
+    field_validator,
+)
+from pydantic_core import from_json
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
 
 from postcard_creator import (
     Address,
@@ -16,7 +34,15 @@ from postcard_creator import (
     Quota,
 )
 
-from ._token import AuthToken, TokenDep
+from ._picture import PictureCache
+from ._token import AuthToken, TokenDep, get_auth_token_json
+
+try:
+    from pybase64 import b64decode as _b64decode
+    from pybase64 import b64encode as _b64encode
+except ImportError:
+    from base64 import b64decode as _b64decode
+    from base64 import b64encode as _b64encode
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -27,19 +53,72 @@ except importlib.metadata.PackageNotFoundError:
     version = "unknown"
 
 
+class _JSONRequest(Request):
+    async def json(self) -> Any:
+        # the body mostly consists of the (multi MB) base64 picture, which
+        # pydantic's JSON parser scans a few times faster than the json module
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            try:
+                self._json = from_json(body, cache_strings=False)
+            except ValueError:
+                # let the json module raise the JSONDecodeError FastAPI expects
+                self._json = json.loads(body)
+        return self._json
+
+
+class _JSONRoute(APIRoute):
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await handler(_JSONRequest(request.scope, request.receive))
+
+        return route_handler
+
+
 app = FastAPI(title="Postcard Creator API", version=version)
+app.router.route_class = _JSONRoute
+
+# (connect, read) timeout for picture downloads
+_PICTURE_TIMEOUT = (3.05, 30)
+# pictures are scaled down to 1819x1311 anyway, larger ones are rejected
+# before they are decoded or downloaded
+MAX_PICTURE_BYTES = 20 * 1024 * 1024
 
 
-def _get_postcard_creator(token: TokenDep) -> PostcardCreator:
-    return PostcardCreator(token)
+def _create_picture_session() -> requests.Session:
+    # shared by all requests, so that connections (and TLS sessions) to the
+    # picture hosts are reused. cookies are not kept, they would otherwise be
+    # shared between the users of the server
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_PICTURE_SESSION = _create_picture_session()
+# the same picture (e.g. a logo) is often sent on many cards
+_PICTURE_CACHE = PictureCache(max_bytes=128 * 1024 * 1024)
+
+
+def _get_postcard_creator(token: TokenDep) -> Iterator[PostcardCreator]:
+    with PostcardCreator(token) as creator:
+        yield creator
 
 
 PostcardCreatorDep = Annotated[PostcardCreator, Depends(_get_postcard_creator)]
 
 
-@app.get("/token")
-def get_token(*, token: TokenDep) -> AuthToken:
-    return AuthToken.from_token(token)
+@app.get("/token", response_model=AuthToken)
+def get_token(*, token: TokenDep) -> Response:
+    return Response(get_auth_token_json(token), media_type="application/json")
 
 
 @app.get("/quota")
@@ -55,32 +134,128 @@ class PictureUrl(BaseModel):
     )
 
 
-class PictureBase64(BaseModel):
-    base64: str = Field(
-        json_schema_extra={
-            "format": "byte",
-        }
+def _read_picture(resp: requests.Response) -> bytes:
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"picture is larger than {MAX_PICTURE_BYTES} bytes",
     )
+    try:
+        content_length = int(resp.headers.get("Content-Length") or 0)
+    except ValueError:
+        # e.g. "10, 10", left to the check below
+        content_length = 0
+    if content_length > MAX_PICTURE_BYTES:
+        raise too_large
+
+    # the Content-Length may be missing, malformed or only cover the compressed
+    # body, so the limit is enforced while reading as well. the chunks are
+    # joined once
+    chunks: list[bytes] = []
+    size = 0
+    for chunk in resp.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > MAX_PICTURE_BYTES:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+_ASCII_WHITESPACE = b" \t\n\r\x0b\x0c"
+
+
+class _Base64Encoder(EncoderProtocol):
+    @classmethod
+    def decode(cls, data: bytes) -> bytes:
+        try:
+            # pybase64 checks the alphabet within its SIMD decoding loop, which
+            # is several times faster than skipping invalid characters
+            return _b64decode(data, validate=True)
+        except binascii.Error:
+            pass
+        # e.g. line wrapped base64. only whitespace is skipped, the lenient
+        # decoder would silently drop any other invalid character as well
+        try:
+            return _b64decode(data.translate(None, _ASCII_WHITESPACE), validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"invalid base64: {e}") from None
+
+    @classmethod
+    def encode(cls, value: bytes) -> bytes:
+        return _b64encode(value)
+
+    @classmethod
+    def get_json_format(cls) -> str:
+        return "byte"
+
+
+class PictureBase64(BaseModel):
+    # decoded once while validating the request body
+    base64: Annotated[bytes, EncodedBytes(encoder=_Base64Encoder)]
+
+    @field_validator("base64", mode="before")
+    @classmethod
+    def _check_size(cls, value: Any) -> Any:
+        # the decoded size follows from the length, no need to decode first
+        if isinstance(value, str):
+            size = len(value) * 3 // 4 - value[-2:].count("=")
+            if size > MAX_PICTURE_BYTES:
+                raise ValueError(f"picture is larger than {MAX_PICTURE_BYTES} bytes")
+        return value
+
+
+def _picture_kind(value: Any) -> str | None:
+    # the picture kind follows from its only field. dispatching on it spares
+    # pydantic from trying (and failing) PictureUrl on every base64 picture
+    if isinstance(value, dict):
+        if "url" in value:
+            return "url"
+        if "base64" in value:
+            return "base64"
+        return None
+    if isinstance(value, PictureUrl):
+        return "url"
+    if isinstance(value, PictureBase64):
+        return "base64"
+    return None
 
 
 class MessageAndPicture(BaseModel):
     message: str
-    picture: PictureUrl | PictureBase64
+    picture: Annotated[
+        Annotated[PictureUrl, Tag("url")] | Annotated[PictureBase64, Tag("base64")],
+        Discriminator(
+            _picture_kind,
+            custom_error_type="invalid_picture",
+            custom_error_message="picture needs either a url or a base64 field",
+        ),
+    ]
 
     @contextmanager
     def open_picture(self) -> Iterator[IO[bytes]]:
         if isinstance(self.picture, PictureUrl):
-            import requests
+            url = self.picture.url
+            cached = _PICTURE_CACHE.get(url)
+            if cached is not None and cached.is_fresh():
+                yield io.BytesIO(cached.content)
+                return
 
-            _LOGGER.info("Downloading picture from %s", self.picture.url)
-            with requests.get(self.picture.url) as resp:
+            headers = {}
+            if cached is not None and cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            _LOGGER.info("Downloading picture from %s", url)
+            with _PICTURE_SESSION.get(
+                url, headers=headers, stream=True, timeout=_PICTURE_TIMEOUT
+            ) as resp:
+                if resp.status_code == 304 and cached is not None:
+                    _PICTURE_CACHE.refresh(url, cached, resp.headers)
+                    yield io.BytesIO(cached.content)
+                    return
                 resp.raise_for_status()
-                yield io.BytesIO(resp.content)
+                content = _read_picture(resp)
+                _PICTURE_CACHE.put(url, content, resp.headers)
+                yield io.BytesIO(content)
         elif isinstance(self.picture, PictureBase64):  # type: ignore
-            import base64
-
-            data = base64.b64decode(self.picture.base64)
-            yield io.BytesIO(data)
+            yield io.BytesIO(self.picture.base64)
 
 
 class SendCardData(BaseModel):
@@ -90,23 +265,34 @@ class SendCardData(BaseModel):
     mock_send: bool = False
 
 
+_SEND_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="send-card")
+
+
+def _send_card(data: SendCardData, creator: PostcardCreator) -> Any:
+    with data.content.open_picture() as picture:
+        return creator.send_card(
+            message=data.content.message,
+            picture=picture,
+            sender=data.sender,
+            recipient=data.recipient,
+            mock_send=data.mock_send,
+            image_export=True,
+        )
+
+
 @app.post("/send-card")
-def send_card(
+async def send_card(
     data: SendCardData,
     *,
     creator: PostcardCreatorDep,
 ) -> None:
+    # the picture download and the upload both block on the network for
+    # seconds. they run in their own threads, so that a burst of cards neither
+    # blocks the event loop nor takes up the threadpool of the other endpoints
     try:
-        with data.content.open_picture() as picture:
-            res = creator.send_card(
-                message=data.content.message,
-                picture=picture,
-                sender=data.sender,
-                recipient=data.recipient,
-                mock_send=data.mock_send,
-                image_export=True,
-            )
-
+        res = await asyncio.get_running_loop().run_in_executor(
+            _SEND_EXECUTOR, _send_card, data, creator
+        )
     except FreeQuotaExceededException as err:
         raise HTTPException(
             status_code=429,
@@ -0,0 +1,103 @@
+import dataclasses
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+@dataclasses.dataclass(slots=True)
+class CachedPicture:
+    content: bytes
+    etag: str | None
+    # time.monotonic() until which the picture is used without revalidation
+    fresh_until: float
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.fresh_until
+
+
+# RFC 9111 caps delta-seconds at 2**31
+_MAX_DELTA_SECONDS = 2**31
+
+
+def _max_age(headers: Mapping[str, str]) -> int | None:
+    # None if the response must not be stored by a cache shared between users,
+    # 0 if it has to be revalidated before every use
+    max_age = 0
+    no_cache = False
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().lower().partition("=")
+        if name in ("no-store", "private"):
+            return None
+        if name == "no-cache":
+            no_cache = True
+        elif name == "max-age":
+            value = value.strip('"')
+            # delta-seconds are a non-negative integer, anything else is stale
+            if value.isascii() and value.isdigit():
+                max_age = min(int(value), _MAX_DELTA_SECONDS)
+            else:
+                max_age = 0
+    return 0 if no_cache else max_age
+
+
+class PictureCache:
+    """LRU cache of downloaded pictures, bounded by their total size.
+
+    Pictures are used as long as the Cache-Control max-age of their response
+    allows, stale ones are revalidated with their ETag.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._pictures: OrderedDict[str, CachedPicture] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> CachedPicture | None:
+        with self._lock:
+            picture = self._pictures.get(url)
+            if picture is not None:
+                self._pictures.move_to_end(url)
+            return picture
+
+    def put(self, url: str, content: bytes, headers: Mapping[str, str]) -> None:
+        max_age = _max_age(headers)
+        etag = headers.get("ETag")
+        # a picture which is neither fresh nor can be revalidated is useless.
+        # a single picture may not evict most of the others either. in both
+        # cases an older version of the picture must not be used anymore
+        if (
+            max_age is None
+            or (max_age <= 0 and etag is None)
+            or len(content) > self.max_bytes // 8
+        ):
+            self.discard(url)
+            return
+
+        picture = CachedPicture(content, etag, time.monotonic() + max_age)
+        with self._lock:
+            old = self._pictures.pop(url, None)
+            if old is not None:
+                self._size -= len(old.content)
+            self._pictures[url] = picture
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                _, evicted = self._pictures.popitem(last=False)
+                self._size -= len(evicted.content)
+
+    def discard(self, url: str) -> None:
+        with self._lock:
+            picture = self._pictures.pop(url, None)
+            if picture is not None:
+                self._size -= len(picture.content)
+
+    def refresh(
+        self, url: str, picture: CachedPicture, headers: Mapping[str, str]
+    ) -> None:
+        # the picture was revalidated (304 Not Modified)
+        max_age = _max_age(headers)
+        if max_age is None:
+            self.discard(url)
+            return
+        picture.fresh_until = time.monotonic() + max_age
@@ -1,9 +1,11 @@
-import functools
 import logging
-from datetime import datetime
+import threading
+import time
+import weakref
+from datetime import UTC, datetime, timedelta
 from typing import Annotated, Self
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 
@@ -30,37 +32,96 @@ class AuthToken(BaseModel):
         )
 
 
+# serialized AuthToken per Token. a token only changes when it is refreshed,
+# which also changes its fetched_at
+_AUTH_TOKEN_JSON: weakref.WeakKeyDictionary[Token, tuple[datetime | None, bytes]] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_auth_token_json(token: Token) -> bytes:
+    cached = _AUTH_TOKEN_JSON.get(token)
+    if cached is not None and cached[0] == token.token_fetched_at:
+        return cached[1]
+    content = AuthToken.from_token(token).model_dump_json().encode()
+    _AUTH_TOKEN_JSON[token] = (token.token_fetched_at, content)
+    return content
+
+
+def _expires_in(token: Token) -> float:
+    # seconds until Token.is_expired() starts to return True
+    assert token.token_fetched_at is not None and token.token_expires_in is not None
+    expires_at = token.token_fetched_at + timedelta(seconds=token.token_expires_in - 60)
+    return (expires_at - datetime.now(UTC)).total_seconds()
+
+
 class TokenManager:
     def __init__(self) -> None:
         self._tokens: dict[str, Token] = {}
-
-    @classmethod
-    @functools.cache
-    def singleton(cls) -> Self:
-        return cls()
+        self._locks: dict[str, threading.Lock] = {}
+        # time.monotonic() deadlines, until which a token is used without
+        # checking its (datetime based) expiry
+        self._deadlines: dict[str, float] = {}
 
     def get(self, creds: HTTPBasicCredentials) -> Token:
-        try:
-            token = self._tokens[creds.username]
-        except KeyError:
-            token = self._tokens[creds.username] = Token()
-        if token.is_expired():
-            _LOGGER.info("Token for %s expired, fetching new token", creds.username)
-            token.fetch_token(creds.username, creds.password)
+        # requests are handled in a threadpool. setdefault is atomic, so
+        # concurrent first requests of a user all end up with the same token
+        token = self._tokens.get(creds.username)
+        if token is None:
+            token = self._tokens.setdefault(creds.username, Token())
+        if time.monotonic() < self._deadlines.get(creds.username, 0.0):
+            return token
+
+        lock = self._locks.setdefault(creds.username, threading.Lock())
+        with lock:
+            # only the first waiting request logs in, the others reuse its token
+            if token.is_expired():
+                _LOGGER.info("Token for %s expired, fetching new token", creds.username)
+                token.fetch_token(creds.username, creds.password)
+            self._deadlines[creds.username] = time.monotonic() + _expires_in(token)
         return token
 
 
-TokenManagerDep = Annotated[TokenManager, Depends(TokenManager.singleton)]
+_TOKEN_MANAGER = TokenManager()
+
+
+class _CachedHTTPBasic(HTTPBasic):
+    """HTTPBasic which remembers the credentials parsed from recent headers.
+
+    Clients send the same Authorization header with every request, so it is
+    decoded only once. The full header is the key.
+    """
+
+    max_cached = 1024
+
+    def __init__(self) -> None:
+        # keep the scheme name of the OpenAPI schema
+        super().__init__(scheme_name=HTTPBasic.__name__)
+        self._credentials: dict[str, HTTPBasicCredentials] = {}
+
+    async def __call__(self, request: Request) -> HTTPBasicCredentials | None:  # type: ignore[override]
+        authorization = request.headers.get("Authorization")
+        if authorization is not None:
+            credentials = self._credentials.get(authorization)
+            if credentials is not None:
+                return credentials
+
+        credentials = await super().__call__(request)
+        if authorization is not None and credentials is not None:
+            if len(self._credentials) >= self.max_cached:
+                self._credentials.clear()
+            self._credentials[authorization] = credentials
+        return credentials
+
 
-_HTTP_BASIC = HTTPBasic()
+_HTTP_BASIC = _CachedHTTPBasic()
 
 
 def _get_token(
     *,
     credentials: Annotated[HTTPBasicCredentials, Depends(_HTTP_BASIC)],
-    token_manager: TokenManagerDep,
 ) -> Token:
-    token = token_manager.get(credentials)
+    token = _TOKEN_MANAGER.get(credentials)
     return token
 
 
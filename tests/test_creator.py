@@ -0,0 +1,240 @@
+import asyncio
+import base64
+import importlib.resources
+import io
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests_mock
+from PIL import Image
+
+from postcard_creator import (
+    Address,
+    AsyncPostcardCreator,
+    FreeQuotaExceededException,
+    PostcardCreator,
+    Quota,
+    Token,
+)
+from postcard_creator._creator import _Base64Writer
+
+URL_PCC_HOST = "https://pccweb.api.post.ch/secure/api/mobile/v1"
+
+QUOTA_MODEL = {
+    "quota": 1,
+    "end": "2025-05-20T00:00:00+02:00",
+    "retentionDays": 1,
+    "available": True,
+    "next": None,
+}
+
+
+def create_postcard_creator() -> tuple[PostcardCreator, requests_mock.Adapter]:
+    token = Token()
+    token.token = "abc"
+    creator = PostcardCreator(token)
+    adapter = requests_mock.Adapter()
+    creator._session.mount("https://", adapter)
+    return creator, adapter
+
+
+def test_get_quota_sends_auth_headers():
+    creator, adapter = create_postcard_creator()
+    adapter.register_uri(
+        "GET", URL_PCC_HOST + "/user/quota", json={"model": QUOTA_MODEL}
+    )
+
+    quota = creator.get_quota()
+
+    assert isinstance(quota, Quota)
+    assert quota.available
+    request = adapter.last_request
+    assert request.headers["Authorization"] == "Bearer abc"
+    assert request.headers["User-Agent"].startswith("Mozilla/5.0")
+
+
+def test_refreshed_token_is_picked_up():
+    creator, adapter = create_postcard_creator()
+    adapter.register_uri(
+        "GET", URL_PCC_HOST + "/user/quota", json={"model": QUOTA_MODEL}
+    )
+
+    creator.token.token = "def"
+    creator.get_quota()
+
+    assert adapter.last_request.headers["Authorization"] == "Bearer def"
+
+
+def create_addresses() -> tuple[Address, Address]:
+    sender = Address(
+        first_name="Hans",
+        last_name="Muster",
+        street="Bahnhofstr. 1",
+        zip_code=8001,
+        place="Zürich",
+    )
+    recipient = Address(
+        first_name="Anna",
+        last_name="Muster",
+        street="Dorfstr. 2",
+        zip_code=3000,
+        place="Bern",
+    )
+    return sender, recipient
+
+
+def test_send_card():
+    creator, adapter = create_postcard_creator()
+    adapter.register_uri(
+        "GET", URL_PCC_HOST + "/user/quota", json={"model": QUOTA_MODEL}
+    )
+    adapter.register_uri(
+        "POST", URL_PCC_HOST + "/card/upload", json={"model": {"orderId": 42}}
+    )
+    sender, recipient = create_addresses()
+
+    with importlib.resources.files(__package__).joinpath("asset.jpg").open("rb") as f:
+        model = creator.send_card(
+            message="Hello", picture=f, sender=sender, recipient=recipient
+        )
+
+    assert model == {"orderId": 42}
+    body = adapter.last_request.json()
+    assert body["sender"]["firstname"] == "Hans"
+    assert body["recipient"]["zip"] == 3000
+    with Image.open(io.BytesIO(base64.b64decode(body["image"]))) as image:
+        assert image.size == (1819, 1311)
+    with Image.open(io.BytesIO(base64.b64decode(body["textImage"]))) as image:
+        assert image.size == (720, 744)
+
+
+def test_send_card_quota_exceeded():
+    creator, adapter = create_postcard_creator()
+    adapter.register_uri(
+        "GET",
+        URL_PCC_HOST + "/user/quota",
+        json={"model": {**QUOTA_MODEL, "available": False}},
+    )
+    sender, recipient = create_addresses()
+
+    with importlib.resources.files(__package__).joinpath("asset.jpg").open("rb") as f:
+        with pytest.raises(FreeQuotaExceededException):
+            creator.send_card(
+                message="Hello", picture=f, sender=sender, recipient=recipient
+            )
+    assert adapter.last_request.method == "GET"
+
+
+def test_close_releases_connections():
+    creator, _ = create_postcard_creator()
+
+    with mock.patch.object(creator._session, "close") as close:
+        with creator:
+            pass
+
+    close.assert_called_once_with()
+
+
+def test_base64_writer_handles_unaligned_chunks():
+    data = bytes(range(256)) * 10
+    writer = _Base64Writer()
+    for start, end in [(0, 1), (1, 2), (2, 7), (7, 1000), (1000, len(data))]:
+        writer.write(data[start:end])
+
+    assert writer.getvalue() == base64.b64encode(data)
+
+
+def test_quota_is_cached_until_a_card_is_sent():
+    creator, adapter = create_postcard_creator()
+    quota_matcher = adapter.register_uri(
+        "GET", URL_PCC_HOST + "/user/quota", json={"model": QUOTA_MODEL}
+    )
+    adapter.register_uri(
+        "POST", URL_PCC_HOST + "/card/upload", json={"model": {"orderId": 42}}
+    )
+    sender, recipient = create_addresses()
+
+    creator.get_quota()
+    creator.get_quota()
+    assert quota_matcher.call_count == 1
+
+    with importlib.resources.files(__package__).joinpath("asset.jpg").open("rb") as f:
+        creator.send_card(
+            message="Hello", picture=f, sender=sender, recipient=recipient
+        )
+    creator.get_quota()
+    assert quota_matcher.call_count == 2
+
+
+def test_async_send_cards_concurrently():
+    async def send_cards() -> list[dict[str, int]]:
+        token = Token()
+        token.token = "abc"
+        async with AsyncPostcardCreator(token) as creator:
+            adapter = requests_mock.Adapter()
+            creator.creator._session.mount("https://", adapter)
+            adapter.register_uri(
+                "GET", URL_PCC_HOST + "/user/quota", json={"model": QUOTA_MODEL}
+            )
+            adapter.register_uri(
+                "POST", URL_PCC_HOST + "/card/upload", json={"model": {"orderId": 42}}
+            )
+            sender, recipient = create_addresses()
+            asset = importlib.resources.files(__package__).joinpath("asset.jpg")
+            return await asyncio.gather(
+                *(
+                    creator.send_card(
+                        message=f"Hello {i}",
+                        picture=io.BytesIO(asset.read_bytes()),
+                        sender=sender,
+                        recipient=recipient,
+                    )
+                    for i in range(3)
+                )
+            )
+
+    assert asyncio.run(send_cards()) == [{"orderId": 42}] * 3
+
+
+def test_async_limits_concurrent_calls():
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def user_info(request, context):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.02)
+        with lock:
+            in_flight -= 1
+        return {"model": {}}
+
+    async def get_user_infos() -> None:
+        token = Token()
+        token.token = "abc"
+        async with AsyncPostcardCreator(token, max_concurrent=2) as creator:
+            assert creator.creator.pool_maxsize == 2
+            adapter = requests_mock.Adapter()
+            creator.creator._session.mount("https://", adapter)
+            adapter.register_uri("GET", URL_PCC_HOST + "/user/current", json=user_info)
+            await asyncio.gather(*(creator.get_user_info() for _ in range(6)))
+
+    asyncio.run(get_user_infos())
+    assert max_in_flight == 2
+
+
+def test_quota_fetched_before_send_not_cached():
+    creator, adapter = create_postcard_creator()
+
+    def quota(request, context):
+        # a card is sent while the quota is fetched
+        creator._quota_generation += 1
+        return {"model": QUOTA_MODEL}
+
+    adapter.register_uri("GET", URL_PCC_HOST + "/user/quota", json=quota)
+    assert creator.get_quota().available
+    assert creator._quota is None
@@ -0,0 +1,86 @@
+import io
+
+from PIL import Image
+
+from postcard_creator._img_util import (
+    _get_dominant_color,
+    _resize_contain,
+    _resize_cover,
+    create_text_image,
+    rotate_and_scale_image,
+)
+
+
+def test_dominant_color():
+    image = Image.new("RGB", (400, 300), (200, 32, 40))
+    image.paste((0, 0, 255), (0, 0, 150, 300))
+    # shades within the same 5 bit bucket count as one color
+    image.paste((202, 35, 44), (250, 0, 400, 300))
+
+    assert _get_dominant_color(image) == (200, 32, 40)
+
+
+def test_resize_cover_crops_center():
+    # red left and right borders are cropped away when fitting 3:2 into 1:1
+    image = Image.new("RGB", (300, 200), (255, 0, 0))
+    image.paste((0, 255, 0), (50, 0, 250, 200))
+
+    cover = _resize_cover(image, (100, 100))
+
+    assert cover.size == (100, 100)
+    assert cover.getpixel((3, 50)) == (0, 255, 0)
+    assert cover.getpixel((96, 50)) == (0, 255, 0)
+
+
+def test_resize_contain_does_not_upscale():
+    image = Image.new("RGB", (50, 20), (0, 0, 0))
+
+    contained = _resize_contain(image, (100, 100), (255, 255, 255))
+
+    assert contained.size == (100, 100)
+    assert contained.getpixel((0, 0)) == (255, 255, 255)
+    assert contained.getpixel((50, 50)) == (0, 0, 0)
+    assert contained.getpixel((50, 35)) == (255, 255, 255)
+
+
+def test_rotate_and_scale_large_portrait_jpeg():
+    # large enough to be decoded at a reduced scale by libjpeg
+    source = io.BytesIO()
+    image = Image.new("RGB", (2000, 4000), (0, 0, 255))
+    image.paste((255, 0, 0), (0, 0, 2000, 2000))
+    image.save(source, "jpeg")
+    source.seek(0)
+
+    fp = io.BytesIO()
+    rotate_and_scale_image(
+        source,
+        fp,
+        img_format="jpeg",
+        enforce_size=True,
+        image_target_width=400,
+        image_target_height=200,
+        image_quality_factor=1,
+    )
+
+    with Image.open(fp) as cover:
+        assert cover.size == (400, 200)
+        # the top of the portrait ends up on the left after rotating
+        r, g, b = cover.getpixel((50, 100))
+        assert r > 200 and b < 50
+        r, g, b = cover.getpixel((350, 100))
+        assert b > 200 and r < 50
+
+
+def test_create_text_image_fits_canvas():
+    text = "\n".join(f"line {i} of a longer postcard message" for i in range(12))
+
+    fp = io.BytesIO()
+    create_text_image(text, fp)
+
+    with Image.open(fp) as image:
+        assert image.size == (720, 744)
+        # nothing may be drawn into the top and bottom margin
+        top = image.crop((0, 0, 720, 5)).convert("L")
+        bottom = image.crop((0, 739, 720, 744)).convert("L")
+        assert top.getextrema()[0] > 200
+        assert bottom.getextrema()[0] > 200
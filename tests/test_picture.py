@@ -0,0 +1,80 @@
+import pytest
+
+from postcard_creator_server._picture import PictureCache, _max_age
+
+
+@pytest.mark.parametrize(
+    ("cache_control", "expected"),
+    [
+        ("max-age=60", 60),
+        ('public, max-age="60"', 60),
+        ("", 0),
+        ("max-age=inf", 0),
+        ("max-age=nan", 0),
+        ("max-age=1e400", 0),
+        ("max-age=-5", 0),
+        ("max-age=" + "9" * 400, 2**31),
+        ("max-age=60, no-cache", 0),
+        ("max-age=60, no-store", None),
+        ("private, max-age=60", None),
+    ],
+)
+def test_max_age(cache_control, expected):
+    assert _max_age({"Cache-Control": cache_control}) == expected
+
+
+def test_picture_cache_fresh():
+    cache = PictureCache(max_bytes=1024)
+    cache.put("url", b"picture", {"Cache-Control": "max-age=60"})
+    picture = cache.get("url")
+    assert picture.content == b"picture"
+    assert picture.is_fresh()
+
+
+def test_picture_cache_stale_revalidated():
+    cache = PictureCache(max_bytes=1024)
+    cache.put("url", b"picture", {"Cache-Control": "no-cache", "ETag": '"v1"'})
+    picture = cache.get("url")
+    assert picture.etag == '"v1"'
+    assert not picture.is_fresh()
+
+    # 304 Not Modified
+    cache.refresh("url", picture, {"Cache-Control": "max-age=60"})
+    assert cache.get("url").is_fresh()
+
+    cache.refresh("url", picture, {"Cache-Control": "no-store"})
+    assert cache.get("url") is None
+
+
+def test_picture_cache_uncacheable():
+    cache = PictureCache(max_bytes=1024)
+    cache.put("url", b"picture", {})
+    assert cache.get("url") is None
+
+    cache.put("url", b"picture", {"Cache-Control": "max-age=60"})
+    cache.put("url", b"changed", {"Cache-Control": "no-store"})
+    assert cache.get("url") is None
+    assert cache._size == 0
+
+
+def test_picture_cache_evicts_by_bytes():
+    cache = PictureCache(max_bytes=800)
+    headers = {"Cache-Control": "max-age=60"}
+    for i in range(8):
+        cache.put(f"url{i}", bytes(100), headers)
+    cache.get("url0")
+    cache.put("url8", bytes(100), headers)
+
+    assert cache.get("url1") is None
+    assert cache.get("url0") is not None
+    assert cache.get("url8") is not None
+    assert cache._size == 800
+
+
+def test_picture_cache_skips_oversized():
+    cache = PictureCache(max_bytes=800)
+    headers = {"Cache-Control": "max-age=60"}
+    cache.put("url", bytes(100), headers)
+    cache.put("url", bytes(101), headers)
+    assert cache.get("url") is None
+    assert cache._size == 0
@@ -0,0 +1,199 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+
+import pydantic
+import pytest
+import requests
+import requests_mock
+from fastapi import HTTPException
+from fastapi.security import HTTPBasicCredentials
+from fastapi.testclient import TestClient
+
+import postcard_creator_server
+from postcard_creator import Token
+from postcard_creator_server import PictureBase64, _read_picture, _token
+from postcard_creator_server._picture import PictureCache
+from postcard_creator_server._token import TokenManager
+
+AUTH = ("user", "password")
+ADDRESS = {
+    "first_name": "Jane",
+    "last_name": "Doe",
+    "street": "Somestreet 1",
+    "zip_code": 8000,
+    "place": "Zurich",
+}
+
+
+def create_response(content, headers):
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.raw = io.BytesIO(content)
+    resp.headers.update(headers)
+    return resp
+
+
+@pytest.fixture
+def fetch_token_calls(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def fetch_token(self, username, password):
+        with lock:
+            calls.append(username)
+        time.sleep(0.05)
+        self.token = "token"
+        self.token_type = "Bearer"
+        self.token_implementation = "swissid"
+        self.token_expires_in = 3600
+        self.token_fetched_at = datetime.now(UTC)
+
+    monkeypatch.setattr(Token, "fetch_token", fetch_token)
+    return calls
+
+
+def test_token_manager_concurrent_first_requests(fetch_token_calls):
+    manager = TokenManager()
+    creds = HTTPBasicCredentials(username="user", password="password")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tokens = list(executor.map(lambda _: manager.get(creds), range(8)))
+
+    assert fetch_token_calls == ["user"]
+    assert all(token is tokens[0] for token in tokens)
+
+
+def test_token_manager_refresh_after_deadline(fetch_token_calls):
+    manager = TokenManager()
+    creds = HTTPBasicCredentials(username="user", password="password")
+    token = manager.get(creds)
+    assert manager.get(creds) is token
+    assert fetch_token_calls == ["user"]
+
+    # deadline passed and the token expired
+    manager._deadlines["user"] = 0.0
+    token.token_expires_in = 0
+    assert manager.get(creds) is token
+    assert fetch_token_calls == ["user", "user"]
+    assert time.monotonic() < manager._deadlines["user"]
+
+
+@pytest.mark.parametrize("data", ["!!!!", "QUJD!!", "QU JD\x00"])
+def test_picture_base64_invalid(data):
+    with pytest.raises(pydantic.ValidationError, match="invalid base64"):
+        PictureBase64(base64=data)
+
+
+def test_picture_base64_whitespace():
+    assert PictureBase64(base64="QUJD\nREVG\r\n").base64 == b"ABCDEF"
+    assert PictureBase64(base64=" QUJD\tREVG ").base64 == b"ABCDEF"
+
+
+def test_read_picture_malformed_content_length(monkeypatch):
+    monkeypatch.setattr(postcard_creator_server, "MAX_PICTURE_BYTES", 8)
+    resp = create_response(b"picture", {"Content-Length": "7, 7"})
+    assert _read_picture(resp) == b"picture"
+
+    resp = create_response(b"too large picture", {"Content-Length": "7, 7"})
+    with pytest.raises(HTTPException) as e:
+        _read_picture(resp)
+    assert e.value.status_code == 413
+
+
+@pytest.fixture
+def client(monkeypatch, fetch_token_calls):
+    monkeypatch.setattr(_token, "_TOKEN_MANAGER", TokenManager())
+    monkeypatch.setattr(_token._HTTP_BASIC, "_credentials", {})
+    monkeypatch.setattr(
+        postcard_creator_server, "_PICTURE_CACHE", PictureCache(max_bytes=1024)
+    )
+    return TestClient(postcard_creator_server.app)
+
+
+@pytest.fixture
+def picture_adapter(monkeypatch):
+    adapter = requests_mock.Adapter()
+    session = requests.Session()
+    session.mount("mock://", adapter)
+    monkeypatch.setattr(postcard_creator_server, "_PICTURE_SESSION", session)
+    return adapter
+
+
+def send_card(client, picture, sender=ADDRESS, recipient=ADDRESS):
+    return client.post(
+        "/send-card",
+        auth=AUTH,
+        json={
+            "sender": sender,
+            "recipient": recipient,
+            "content": {"message": "Hello", "picture": picture},
+        },
+    )
+
+
+def test_credentials_cached(client, fetch_token_calls):
+    assert client.get("/token", auth=AUTH).status_code == 200
+    credentials = list(_token._HTTP_BASIC._credentials.values())
+    assert len(credentials) == 1
+    assert credentials[0].username == "user"
+
+    assert client.get("/token", auth=AUTH).json()["token"] == "token"
+    assert list(_token._HTTP_BASIC._credentials.values()) == credentials
+    assert fetch_token_calls == ["user"]
+
+    assert client.get("/token").status_code == 401
+
+
+def test_send_card_invalid_json(client):
+    resp = client.post(
+        "/send-card",
+        auth=AUTH,
+        content=b'{"sender": ',
+        headers={"Content-Type": "application/json"},
+    )
+    assert resp.status_code == 422
+    assert resp.json()["detail"][0]["type"] == "json_invalid"
+
+
+def test_send_card_picture_without_field(client):
+    resp = send_card(client, {"uri": "mock://pictures/picture.jpg"})
+    assert resp.status_code == 422
+    (error,) = resp.json()["detail"]
+    assert error["type"] == "invalid_picture"
+    assert error["loc"] == ["body", "content", "picture"]
+
+
+def test_send_card_oversized_base64(client, monkeypatch):
+    monkeypatch.setattr(postcard_creator_server, "MAX_PICTURE_BYTES", 8)
+    resp = send_card(client, {"base64": "QUJD" * 4})
+    assert resp.status_code == 422
+    assert "picture is larger than 8 bytes" in resp.text
+
+
+def test_send_card_content_length_too_large(client, monkeypatch, picture_adapter):
+    monkeypatch.setattr(postcard_creator_server, "MAX_PICTURE_BYTES", 8)
+    picture_adapter.register_uri(
+        "GET",
+        "mock://pictures/picture.jpg",
+        content=b"picture",
+        headers={"Content-Length": "100"},
+    )
+    resp = send_card(client, {"url": "mock://pictures/picture.jpg"})
+    assert resp.status_code == 413
+
+
+def test_send_card_address_errors(client):
+    picture = {"uri": "mock://pictures/picture.jpg"}
+    invalid = {**ADDRESS, "zip_code": "abc"}
+    for _ in range(2):
+        resp = send_card(client, picture, sender=ADDRESS, recipient=invalid)
+        locs = [error["loc"] for error in resp.json()["detail"]]
+        assert ["body", "recipient", "zip_code"] in locs
+        assert not any(loc[:2] == ["body", "sender"] for loc in locs)
+
+    resp = send_card(client, picture, sender=invalid, recipient=ADDRESS)
+    locs = [error["loc"] for error in resp.json()["detail"]]
+    assert ["body", "sender", "zip_code"] in locs
+    assert not any(loc[:2] == ["body", "recipient"] for loc in locs)
@@ -11,6 +11,7 @@ from postcard_creator import (
     PostcardCreatorException,
     Token,
 )
+from postcard_creator._auth import base64_decode, base64_encode
 
 logging.basicConfig(level=logging.INFO, format="%(name)s (%(levelname)s): %(message)s")
 logging.getLogger("postcard_creator").setLevel(10)
@@ -65,3 +66,44 @@ def test_token_invalid_args():
     with pytest.raises(PostcardCreatorException):
         token = create_token()
         token.fetch_token(None, None)
+
+
+def test_token_reuses_session_without_cookies():
+    token = create_token()
+    session = token._get_session()
+    session.cookies.set("JSESSIONID", "abc")
+
+    assert token._get_session() is session
+    assert not session.cookies
+
+
+@pytest.mark.parametrize("data", [b"", b"a", b"ab", b"abc", b"abcd", bytes(range(64))])
+def test_base64_roundtrip(data):
+    assert base64_decode(base64_encode(data)) == data
+
+
+def test_token_legacy_login_without_second_post():
+    token = create_token()
+    adapter = requests_mock.Adapter()
+    token._get_session().mount("https://", adapter)
+    saml_response = importlib.resources.read_text(__package__, "saml_response.html")
+    access_token = {"access_token": "abc", "token_type": "Bearer", "expires_in": 3600}
+
+    adapter.register_uri("GET", "https://pccweb.api.post.ch/OAuth/authorization")
+    login = adapter.register_uri(
+        "POST", "https://account.post.ch/idp/", text=saml_response
+    )
+    adapter.register_uri(
+        "POST",
+        "https://pccweb.api.post.ch/OAuth/",
+        status_code=302,
+        headers={"Location": "ch.post.pcc://auth/callback?code=xyz"},
+    )
+    adapter.register_uri(
+        "POST", "https://pccweb.api.post.ch/OAuth/token", json=access_token
+    )
+
+    token.fetch_token("user", "password", method="legacy")
+
+    assert token.token == "abc"
+    assert login.call_count == 1